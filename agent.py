@@ -1,21 +1,48 @@
-import json
+import hashlib
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set, Tuple, ClassVar
 import os
 import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+import aiofiles
 import aiohttp
 import asyncio
+import faiss
+import numpy as np
+import orjson
+from numba import njit
 from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 from llama_index.core import (
     VectorStoreIndex,
     Document,
     StorageContext,
     load_index_from_storage,
+    PromptTemplate,
     Settings,
+    SummaryIndex,
 )
 from llama_index.llms.ollama import Ollama
+from llama_index.core.base.base_query_engine import BaseQueryEngine
 from llama_index.core.node_parser import SimpleNodeParser
+from llama_index.core.schema import MetadataMode, TextNode
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.vector_stores import (
+    ExactMatchFilter,
+    FilterCondition,
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+    SimpleVectorStore,
+)
+from llama_index.core.vector_stores.types import (
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
 from llama_index.embeddings.ollama import OllamaEmbedding
 
 logging.basicConfig(
@@ -24,11 +51,363 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@dataclass
+_HISTORICAL_SECTION_RE = re.compile(
+    r"^[ \t]*##\s*Historical Changes\s*(.*?)(?=^[ \t]*##\s*Current Snapshot|\Z)",
+    re.IGNORECASE | re.DOTALL | re.MULTILINE
+)
+_CURRENT_SECTION_RE = re.compile(
+    r"^[ \t]*##\s*Current Snapshot\s*(.*)",
+    re.IGNORECASE | re.DOTALL | re.MULTILINE
+)
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+_WS_RE = re.compile(r"\s+")
+
+REPORT_PROMPT = PromptTemplate(
+    """
+    Generate a weekly competitive analysis report based on the following data:
+    ---------------------
+    {context_str}
+    ---------------------
+    {query_str}
+    """
+)
+REPORT_QUERY = """
+Format the report with:
+1. Executive Summary
+2. Key Findings by Competitor
+3. Market Trends
+4. Historical Changes
+5. Recommendations
+
+Focus on significant changes and their market impact.
+"""
+
+def quantize_embedding(embedding: List[float]) -> List[float]:
+    # Symmetric per-vector int8 quantization. The per-vector scale is
+    # dropped on purpose: cosine similarity does not depend on it.
+    scale = max((abs(value) for value in embedding), default=0.0)
+    if not scale:
+        return list(embedding)
+    return [round(value * 127 / scale) for value in embedding]
+
+class QuantizedOllamaEmbedding(OllamaEmbedding):
+    @classmethod
+    def class_name(cls) -> str:
+        return "QuantizedOllamaEmbedding"
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return quantize_embedding(super()._get_query_embedding(query))
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return quantize_embedding(await super()._aget_query_embedding(query))
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return quantize_embedding(super()._get_text_embedding(text))
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return quantize_embedding(await super()._aget_text_embedding(text))
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [quantize_embedding(e) for e in super()._get_text_embeddings(texts)]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [quantize_embedding(e) for e in await super()._aget_text_embeddings(texts)]
+
+@njit('f4(f4[::1], f4[::1])', fastmath=True, cache=True)
+def _inner_product(a, b):
+    total = np.float32(0.0)
+    for i in range(a.shape[0]):
+        total += a[i] * b[i]
+    return total
+
+@njit('f4[::1](f4[:, ::1], f4[::1], i8[::1])', fastmath=True, cache=True)
+def _score_rows(embeddings, query, rows):
+    scores = np.empty(rows.shape[0], dtype=np.float32)
+    for i in range(rows.shape[0]):
+        scores[i] = _inner_product(embeddings[rows[i]], query)
+    return scores
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+def _is_exact_match(filters: Optional[MetadataFilters]) -> bool:
+    if filters is None:
+        return True
+    if filters.condition not in (None, FilterCondition.AND):
+        return False
+    return all(
+        isinstance(f, ExactMatchFilter)
+        or (isinstance(f, MetadataFilter) and f.operator == FilterOperator.EQ)
+        for f in filters.filters
+    )
+
+class NumbaVectorStore(SimpleVectorStore):
+    # Embeddings are scored as one contiguous, L2-normalised float32 matrix
+    # that is built lazily and extended on add; a delete or replace drops it.
+    # Exact-match filters are answered from a per-key index of value -> rows,
+    # so picking a competitor's candidates is a dict lookup rather than a
+    # scan over every node. Queries this path can't serve (other modes,
+    # non exact-match filters) fall back to SimpleVectorStore.
+    _flat: Optional[Tuple[List[str], np.ndarray]] = PrivateAttr(default=None)
+    _row_index: Dict[str, Dict[Any, np.ndarray]] = PrivateAttr(default_factory=dict)
+    _build_lock: Any = PrivateAttr(default_factory=threading.RLock)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumbaVectorStore"
+
+    def add(self, nodes, **add_kwargs):
+        replaced = any(node.node_id in self.data.embedding_dict for node in nodes)
+        ids = super().add(nodes, **add_kwargs)
+        if replaced:
+            self._invalidate()
+        else:
+            self._append(ids)
+        return ids
+
+    def delete(self, ref_doc_id: str, **delete_kwargs):
+        super().delete(ref_doc_id, **delete_kwargs)
+        self._invalidate()
+
+    def delete_nodes(self, node_ids=None, filters=None, **delete_kwargs):
+        super().delete_nodes(node_ids, filters, **delete_kwargs)
+        self._invalidate()
+
+    def clear(self):
+        super().clear()
+        self._invalidate()
+
+    # The async variants are pinned to the overrides above so a change in the
+    # base class defaults can't bypass the cache invalidation.
+    async def adelete(self, ref_doc_id: str, **delete_kwargs):
+        self.delete(ref_doc_id, **delete_kwargs)
+
+    async def adelete_nodes(self, node_ids=None, filters=None, **delete_kwargs):
+        self.delete_nodes(node_ids, filters, **delete_kwargs)
+
+    async def aclear(self):
+        self.clear()
+
+    def _invalidate(self):
+        with self._build_lock:
+            self._flat = None
+            self._row_index = {}
+
+    def _group_rows(self, node_ids: List[str], key: str, offset: int = 0) -> Dict[Any, np.ndarray]:
+        # Raises TypeError for unhashable metadata values; callers then scan.
+        groups: Dict[Any, List[int]] = {}
+        metadata_dict = self.data.metadata_dict
+        for row, node_id in enumerate(node_ids, start=offset):
+            groups.setdefault(metadata_dict.get(node_id, {}).get(key), []).append(row)
+        return {value: np.array(rows, dtype=np.int64) for value, rows in groups.items()}
+
+    def _append(self, node_ids: List[str]):
+        # New nodes land at the end of embedding_dict, so existing row
+        # positions stay valid and only the new rows need normalising.
+        with self._build_lock:
+            if self._flat is None or not node_ids:
+                return
+            old_ids, old_matrix = self._flat
+            new_rows = np.array(
+                [self.data.embedding_dict[node_id] for node_id in node_ids],
+                dtype=np.float32
+            ).reshape(len(node_ids), -1)
+            self._flat = (old_ids + list(node_ids), np.vstack([old_matrix, _normalize_rows(new_rows)]))
+            # Arrays are replaced rather than extended in place, so a query
+            # still holding the previous snapshot keeps consistent rows.
+            for key in list(self._row_index):
+                by_value = dict(self._row_index[key])
+                try:
+                    groups = self._group_rows(list(node_ids), key, offset=len(old_ids))
+                except TypeError:
+                    del self._row_index[key]
+                    continue
+                for value, rows in groups.items():
+                    if value in by_value:
+                        by_value[value] = np.concatenate([by_value[value], rows])
+                    else:
+                        by_value[value] = rows
+                self._row_index[key] = by_value
+
+    def _get_flat(self) -> Tuple[List[str], np.ndarray]:
+        with self._build_lock:
+            if self._flat is None:
+                node_ids = list(self.data.embedding_dict)
+                matrix = np.array(
+                    [self.data.embedding_dict[node_id] for node_id in node_ids],
+                    dtype=np.float32
+                ).reshape(len(node_ids), -1)
+                self._flat = (node_ids, _normalize_rows(matrix))
+                self._row_index = {}
+            return self._flat
+
+    def _filter_rows(self, node_ids: List[str], key: str, value: Any) -> np.ndarray:
+        # Callers must hold _build_lock, with node_ids from the current _flat.
+        try:
+            by_value = self._row_index.get(key)
+            if by_value is None:
+                by_value = self._row_index[key] = self._group_rows(node_ids, key)
+            return by_value.get(value, np.empty(0, dtype=np.int64))
+        except TypeError:
+            metadata_dict = self.data.metadata_dict
+            return np.fromiter(
+                (
+                    row for row, node_id in enumerate(node_ids)
+                    if metadata_dict.get(node_id, {}).get(key) == value
+                ),
+                dtype=np.int64
+            )
+
+    def _candidate_rows(self, node_ids: List[str], query: VectorStoreQuery) -> np.ndarray:
+        # Callers must hold _build_lock, with node_ids from the current _flat.
+        rows = None
+        for f in query.filters.filters if query.filters else []:
+            matched = self._filter_rows(node_ids, f.key, f.value)
+            # Row arrays are ascending, which keeps the intersection sorted.
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        if rows is None:
+            rows = np.arange(len(node_ids), dtype=np.int64)
+        if query.node_ids is not None:
+            allowed = set(query.node_ids)
+            rows = np.fromiter((row for row in rows if node_ids[row] in allowed), dtype=np.int64)
+        return rows
+
+    def query(self, query: VectorStoreQuery, **kwargs) -> VectorStoreQueryResult:
+        if (
+            query.mode != VectorStoreQueryMode.DEFAULT
+            or query.query_embedding is None
+            or not self.data.embedding_dict
+            or not _is_exact_match(query.filters)
+        ):
+            return super().query(query, **kwargs)
+        with self._build_lock:
+            node_ids, matrix = self._get_flat()
+            rows = self._candidate_rows(node_ids, query)
+        if rows.size == 0:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+        embedding = np.asarray(query.query_embedding, dtype=np.float32)
+        embedding = _normalize_rows(embedding.reshape(1, -1))[0]
+        top_k = min(query.similarity_top_k, rows.size)
+        scores, positions = self._search(matrix, embedding, rows, top_k)
+        return VectorStoreQueryResult(
+            similarities=scores.tolist(),
+            ids=[node_ids[position] for position in positions]
+        )
+
+    def _search(
+        self,
+        matrix: np.ndarray,
+        embedding: np.ndarray,
+        rows: np.ndarray,
+        top_k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        scores = _score_rows(matrix, embedding, rows)
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return scores[top], rows[top]
+
+class HNSWVectorStore(NumbaVectorStore):
+    # Candidate sets of at least HNSW_MIN_SIZE vectors are searched through a
+    # FAISS HNSW graph over 8-bit scalar-quantised vectors, restricted to the
+    # filtered rows with an IDSelector. Smaller sets keep the exact flat scan.
+    # The quantiser is trained once; rows appended later are added to the
+    # existing graph, which is only rebuilt after a delete or replace.
+    HNSW_MIN_SIZE: ClassVar[int] = 1024
+    HNSW_M: ClassVar[int] = 32
+    HNSW_EF_SEARCH: ClassVar[int] = 64
+    HNSW_FNAME: ClassVar[str] = "hnsw_vector_store.faiss"
+
+    _hnsw: Optional[Any] = PrivateAttr(default=None)
+    _hnsw_lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HNSWVectorStore"
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str, fs=None) -> "HNSWVectorStore":
+        store = super().from_persist_path(persist_path, fs=fs)
+        hnsw_path = os.path.join(os.path.dirname(persist_path), cls.HNSW_FNAME)
+        if os.path.exists(hnsw_path):
+            hnsw = faiss.read_index(hnsw_path)
+            # Rows added since the graph was saved are appended on first use.
+            if hnsw.ntotal <= len(store.data.embedding_dict):
+                store._hnsw = hnsw
+        return store
+
+    def persist(self, persist_path: str, fs=None):
+        super().persist(persist_path, fs=fs)
+        hnsw_path = os.path.join(os.path.dirname(persist_path), self.HNSW_FNAME)
+        with self._hnsw_lock:
+            if self._hnsw is not None:
+                faiss.write_index(self._hnsw, hnsw_path)
+            elif os.path.exists(hnsw_path):
+                # A graph left over from before the last delete/replace would
+                # no longer line up with the stored embeddings.
+                os.remove(hnsw_path)
+
+    def _invalidate(self):
+        super()._invalidate()
+        self._hnsw = None
+
+    def _get_hnsw(self, matrix: np.ndarray):
+        # Callers must hold _hnsw_lock.
+        if self._hnsw is None:
+            hnsw = faiss.IndexHNSWSQ(
+                matrix.shape[1],
+                faiss.ScalarQuantizer.QT_8bit,
+                self.HNSW_M,
+                faiss.METRIC_INNER_PRODUCT
+            )
+            hnsw.train(matrix)
+            self._hnsw = hnsw
+        if self._hnsw.ntotal < matrix.shape[0]:
+            self._hnsw.add(matrix[self._hnsw.ntotal:])
+        return self._hnsw
+
+    def _search(
+        self,
+        matrix: np.ndarray,
+        embedding: np.ndarray,
+        rows: np.ndarray,
+        top_k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if rows.size < self.HNSW_MIN_SIZE:
+            return super()._search(matrix, embedding, rows, top_k)
+        # FAISS indexes are not safe to add to while searching. Rather than
+        # queue behind a graph update, a contended query takes the exact scan.
+        if not self._hnsw_lock.acquire(blocking=False):
+            return super()._search(matrix, embedding, rows, top_k)
+        try:
+            hnsw = self._get_hnsw(matrix)
+            selector = faiss.IDSelectorBatch(rows)
+            params = faiss.SearchParametersHNSW(
+                sel=selector,
+                efSearch=max(self.HNSW_EF_SEARCH, top_k)
+            )
+            scores, positions = hnsw.search(embedding.reshape(1, -1), top_k, params=params)
+        finally:
+            self._hnsw_lock.release()
+        found = positions[0] >= 0
+        if found.sum() < top_k:
+            # Heavily filtered searches can strand the graph walk; stay exact.
+            return super()._search(matrix, embedding, rows, top_k)
+        return scores[0][found], positions[0][found]
+
+@dataclass(slots=True, frozen=True)
 class Competitor:
     name: str
     website: str
-    social_media: Dict[str, str]
+    social_media: Tuple[Tuple[str, str], ...]
+
+@dataclass
+class ScrapeResult:
+    text: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    not_modified: bool = False
 
 class CompetitorDatabase:
     def __init__(self, storage_dir: str = "competitor_data"):
@@ -38,15 +417,132 @@ class CompetitorDatabase:
             base_url="http://localhost:11434",
             request_timeout=60.0
         )
-        self.embed_model = OllamaEmbedding(
+        self.embed_model = QuantizedOllamaEmbedding(
             model_name="your-model",
             base_url="http://localhost:11434",
-            ollama_additional_kwargs={"mirostat": 0}
+            ollama_additional_kwargs={"mirostat": 0},
+            # A weekly batch is chunked into many nodes; the default of 10 would
+            # split it into one /api/embed round trip per ten chunks.
+            embed_batch_size=2048
         )
         Settings.llm = self.llm
         Settings.embed_model = self.embed_model
         Settings.chunk_size = 512
+        self.node_parser = SimpleNodeParser.from_defaults(
+            chunk_size=Settings.chunk_size,
+            chunk_overlap=32
+        )
         os.makedirs(storage_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._dirty = False
+        self.page_cache_path = os.path.join(storage_dir, "etags.json")
+        self._page_cache: Dict[str, Dict[str, Optional[str]]] = self._load_json(self.page_cache_path)
+        self._page_cache_dirty = False
+        self.analysis_cache_path = os.path.join(storage_dir, "latest_analyses.json")
+        self._analysis_cache: Dict[str, Dict[str, Any]] = self._load_json(self.analysis_cache_path)
+        self._analysis_cache_dirty = False
+        self.index = self._load_index()
+        self._engines: Dict[str, BaseQueryEngine] = {}
+        self._competitors: Set[str] = {
+            doc.metadata["competitor"]
+            for doc in self.index.docstore.docs.values()
+            if "competitor" in doc.metadata
+        }
+
+    def _load_index(self) -> VectorStoreIndex:
+        if os.path.exists(os.path.join(self.storage_dir, "docstore.json")):
+            try:
+                return load_index_from_storage(
+                    StorageContext.from_defaults(
+                        persist_dir=self.storage_dir,
+                        vector_store=HNSWVectorStore.from_persist_dir(self.storage_dir)
+                    )
+                )
+            except Exception as e:
+                logger.warning(f"Could not load competitor index, starting a new one: {str(e)}")
+        index = VectorStoreIndex(
+            [],
+            storage_context=StorageContext.from_defaults(vector_store=HNSWVectorStore())
+        )
+        self._migrate_competitor_indices(index)
+        return index
+
+    def _migrate_competitor_indices(self, index: VectorStoreIndex):
+        # Older versions kept one index per competitor in its own sub-directory.
+        for entry in sorted(os.listdir(self.storage_dir)):
+            competitor_dir = os.path.join(self.storage_dir, entry)
+            if not os.path.exists(os.path.join(competitor_dir, "docstore.json")):
+                continue
+            try:
+                legacy = load_index_from_storage(
+                    StorageContext.from_defaults(persist_dir=competitor_dir)
+                )
+                nodes = legacy.docstore.get_nodes(list(legacy.index_struct.nodes_dict.values()))
+                for node in nodes:
+                    node.metadata.setdefault("competitor", entry)
+                    node.embedding = legacy.vector_store.get(node.node_id)
+                index.insert_nodes(nodes)
+                self._dirty = True
+                logger.info(f"Migrated {len(nodes)} stored snapshots for {entry}")
+            except Exception as e:
+                logger.warning(f"Could not migrate stored data for {entry}: {str(e)}")
+
+    @staticmethod
+    def _load_json(path: str) -> Dict[str, Any]:
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, 'rb') as f:
+                return orjson.loads(f.read())
+        except Exception as e:
+            logger.warning(f"Could not load {path}, starting a new one: {str(e)}")
+            return {}
+
+    @staticmethod
+    def _content_hash(content: str) -> str:
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get_page_validators(self, competitor_name: str) -> Dict[str, Optional[str]]:
+        # Validators are only useful if the snapshot they describe is stored.
+        if competitor_name not in self._competitors:
+            return {}
+        return self._page_cache.get(competitor_name, {})
+
+    def has_page_changed(self, competitor_name: str, content: str) -> bool:
+        cached = self.get_page_validators(competitor_name)
+        return cached.get("sha256") != self._content_hash(content)
+
+    def record_page(self, competitor_name: str, page: ScrapeResult):
+        with self._lock:
+            self._page_cache[competitor_name] = {
+                "etag": page.etag,
+                "last_modified": page.last_modified,
+                "sha256": self._content_hash(page.text)
+            }
+            self._page_cache_dirty = True
+
+    def get_latest_analysis(self, competitor_name: str) -> Dict[str, Any]:
+        return self._analysis_cache.get(competitor_name, {})
+
+    def record_analysis(self, competitor_name: str, analysis: Dict[str, Any]):
+        with self._lock:
+            self._analysis_cache[competitor_name] = analysis
+            self._analysis_cache_dirty = True
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self.index.storage_context.persist(persist_dir=self.storage_dir)
+                self._dirty = False
+                logger.info(f"Persisted competitor data to {self.storage_dir}")
+            if self._page_cache_dirty:
+                with open(self.page_cache_path, 'wb') as f:
+                    f.write(orjson.dumps(self._page_cache, option=orjson.OPT_INDENT_2))
+                self._page_cache_dirty = False
+            if self._analysis_cache_dirty:
+                with open(self.analysis_cache_path, 'wb') as f:
+                    f.write(orjson.dumps(self._analysis_cache, option=orjson.OPT_INDENT_2))
+                self._analysis_cache_dirty = False
 
     def test_embeddings(self):
         try:
@@ -67,41 +563,126 @@ class CompetitorDatabase:
             logger.error(f"Error testing embeddings: {str(e)}")
             return False
 
+    def test_vector_store(self):
+        # Checks the cached matrix/graph against SimpleVectorStore's own scan
+        # across add, delete_nodes, delete and clear. Needs no Ollama server.
+        try:
+            rng = np.random.default_rng(0)
+            def make_nodes(start: int, count: int) -> List[TextNode]:
+                return [
+                    TextNode(
+                        id_=f"node-{i}",
+                        text=f"snapshot {i}",
+                        metadata={"competitor": "AB"[i % 2]},
+                        embedding=quantize_embedding(rng.normal(size=32).tolist())
+                    )
+                    for i in range(start, start + count)
+                ]
+            def check(store: NumbaVectorStore, step: str, exact: bool):
+                for competitor in ("A", "B", None):
+                    query = VectorStoreQuery(
+                        query_embedding=quantize_embedding(rng.normal(size=32).tolist()),
+                        similarity_top_k=5,
+                        filters=MetadataFilters(
+                            filters=[ExactMatchFilter(key="competitor", value=competitor)]
+                        ) if competitor else None
+                    )
+                    result = store.query(query)
+                    if exact:
+                        expected = SimpleVectorStore.query(store, query)
+                        if result.ids != expected.ids:
+                            raise ValueError(f"{step}: {result.ids} != {expected.ids}")
+                    for node_id in result.ids:
+                        if node_id not in store.data.embedding_dict:
+                            raise ValueError(f"{step}: stale id {node_id}")
+                        if competitor and store.data.metadata_dict[node_id]["competitor"] != competitor:
+                            raise ValueError(f"{step}: filter ignored")
+
+            flat = NumbaVectorStore()
+            flat.add(make_nodes(0, 50))
+            check(flat, "add", exact=True)
+            flat.add(make_nodes(50, 10))
+            check(flat, "append", exact=True)
+            flat.delete_nodes([f"node-{i}" for i in range(0, 60, 3)])
+            check(flat, "delete_nodes", exact=True)
+            flat.clear()
+            flat.add(make_nodes(100, 3))
+            check(flat, "clear", exact=True)
+
+            # Above HNSW_MIN_SIZE results are approximate, so only check that
+            # deleted ids never come back and that the filter holds.
+            hnsw = HNSWVectorStore()
+            hnsw.add(make_nodes(0, HNSWVectorStore.HNSW_MIN_SIZE * 3))
+            check(hnsw, "hnsw add", exact=False)
+            hnsw.add(make_nodes(HNSWVectorStore.HNSW_MIN_SIZE * 3, 50))
+            check(hnsw, "hnsw append", exact=False)
+            hnsw.delete_nodes([f"node-{i}" for i in range(0, HNSWVectorStore.HNSW_MIN_SIZE, 2)])
+            check(hnsw, "hnsw delete_nodes", exact=False)
+            hnsw.clear()
+            hnsw.add(make_nodes(0, 3))
+            check(hnsw, "hnsw clear", exact=True)
+            logger.info("Vector store matches SimpleVectorStore")
+            return True
+        except Exception as e:
+            logger.error(f"Error testing vector store: {str(e)}")
+            return False
+
     def store_competitor_data(self, competitor_name: str, content: str, date: str):
+        return self.store_competitor_batch([(competitor_name, content, date)])
+
+    def store_competitor_batch(self, entries: List[Tuple[str, str, str]]):
         try:
-            doc = Document(
-                text=content,
-                metadata={
-                    "competitor": competitor_name,
-                    "date": date
-                }
-            )
-            competitor_dir = os.path.join(self.storage_dir, competitor_name)
-            os.makedirs(competitor_dir, exist_ok=True)
-            try:
-                index = load_index_from_storage(
-                    StorageContext.from_defaults(persist_dir=competitor_dir)
+            docs = [
+                Document(
+                    text=content,
+                    metadata={
+                        "competitor": competitor_name,
+                        "date": date
+                    }
                 )
-            except:
-                index = VectorStoreIndex.from_documents([doc])
-            index.insert(doc)
-            index.storage_context.persist(persist_dir=competitor_dir)
-            logger.info(f"Stored data for {competitor_name}")
+                for competitor_name, content, date in entries
+            ]
+            if not docs:
+                return True
+            nodes = self.node_parser.get_nodes_from_documents(docs)
+            embeddings = self.embed_model.get_text_embedding_batch(
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes],
+                show_progress=False
+            )
+            for node, embedding in zip(nodes, embeddings):
+                node.embedding = embedding
+            with self._lock:
+                self.index.insert_nodes(nodes)
+                self._competitors.update(doc.metadata["competitor"] for doc in docs)
+                self._dirty = True
+            for doc in docs:
+                logger.info(f"Stored data for {doc.metadata['competitor']}")
             return True
         except Exception as e:
             logger.error(f"Error storing competitor data: {str(e)}")
             return False
 
+    def _get_engine(self, competitor_name: str) -> BaseQueryEngine:
+        # The retriever reads the shared index on every query, so cached
+        # engines already see documents inserted after they were built.
+        with self._lock:
+            engine = self._engines.get(competitor_name)
+            if engine is None:
+                filters = MetadataFilters(
+                    filters=[ExactMatchFilter(key="competitor", value=competitor_name)]
+                )
+                engine = self._engines[competitor_name] = self.index.as_query_engine(
+                    filters=filters,
+                    response_mode="compact",
+                    similarity_top_k=8
+                )
+            return engine
+
     def query_competitor_history(self, competitor_name: str, query: str) -> str:
         try:
-            competitor_dir = os.path.join(self.storage_dir, competitor_name)
-            if not os.path.exists(competitor_dir):
+            if competitor_name not in self._competitors:
                 return ""
-            index = load_index_from_storage(
-                StorageContext.from_defaults(persist_dir=competitor_dir)
-            )
-            query_engine = index.as_query_engine()
-            response = query_engine.query(query)
+            response = self._get_engine(competitor_name).query(query)
             return str(response)
         except Exception as e:
             logger.error(f"Error querying competitor history: {str(e)}")
@@ -112,130 +693,324 @@ class WebScraper:
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "WebScraper":
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300)
+            )
+        return self
 
-    async def scrape_website(self, url: str) -> str:
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @staticmethod
+    def extract_text(html: str) -> str:
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=self.headers) as response:
-                    if response.status == 200:
-                        html = await response.text()
-                        soup = BeautifulSoup(html, 'html.parser')
-                        for script in soup(["script", "style"]):
-                            script.decompose()
-                        text = soup.get_text(separator='\n', strip=True)
-                        lines = (line.strip() for line in text.splitlines())
-                        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                        text = ' '.join(chunk for chunk in chunks if chunk)
-                        return text
-                    else:
-                        logger.error(f"Error scraping website {url}: {response.status}")
-                        return ""
+            tree = LexborHTMLParser(html)
+            tree.strip_tags(["script", "style", "noscript"])
+            root = tree.body or tree.root
+            text = root.text(separator=' ')
+        except Exception as e:
+            logger.warning(f"selectolax failed to parse page, falling back to BeautifulSoup: {str(e)}")
+            soup = BeautifulSoup(html, 'lxml')
+            for tag in soup.select("script, style, noscript, template"):
+                tag.decompose()
+            text = soup.get_text(separator=' ', strip=True)
+        return _WS_RE.sub(' ', text).strip()
+
+    async def scrape_website(
+        self,
+        url: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ) -> ScrapeResult:
+        try:
+            if self._session is None or self._session.closed:
+                # Allow one-off calls outside of ``async with``; the session
+                # is closed again so no connector is leaked.
+                async with self:
+                    return await self.scrape_website(url, etag, last_modified)
+            headers = {}
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+            async with self._session.get(url, headers=headers) as response:
+                if response.status == 304:
+                    return ScrapeResult(etag=etag, last_modified=last_modified, not_modified=True)
+                elif response.status == 200:
+                    html = await response.text()
+                    return ScrapeResult(
+                        text=self.extract_text(html),
+                        etag=response.headers.get('ETag'),
+                        last_modified=response.headers.get('Last-Modified')
+                    )
+                else:
+                    logger.error(f"Error scraping website {url}: {response.status}")
+                    return ScrapeResult()
         except Exception as e:
             logger.error(f"Exception in scrape_website: {str(e)}")
-            return ""
+            return ScrapeResult()
 
 class CompetitiveAnalysisAgent:
-    def __init__(self):
+    def __init__(self, max_concurrency: int = 8):
         self.web_scraper = WebScraper()
         self.competitor_db = CompetitorDatabase()
+        self.max_concurrency = max_concurrency
+        # Matches the number of requests the Ollama server decodes in parallel;
+        # anything above that just queues on the server and thrashes its KV cache.
+        self._llm_sem = asyncio.Semaphore(int(os.getenv("OLLAMA_NUM_PARALLEL", "4")))
 
     def load_competitors(self, file_path: str) -> List[Competitor]:
         try:
-            with open(file_path, 'r') as f:
-                data = json.load(f)
+            with open(file_path, 'rb') as f:
+                data = orjson.loads(f.read())
                 competitors_data = data.get('competitors', [])
-                return [Competitor(**comp) for comp in competitors_data]
+                return [
+                    Competitor(
+                        name=comp['name'],
+                        website=comp['website'],
+                        social_media=tuple((comp.get('social_media') or {}).items())
+                    )
+                    for comp in competitors_data
+                ]
         except Exception as e:
             logger.error(f"Error loading competitors: {str(e)}")
             return []
 
-    async def analyze_competitor_website(self, competitor: Competitor) -> Dict[str, Any]:
-        current_content = await self.web_scraper.scrape_website(competitor.website)
-        today = datetime.now().strftime("%Y-%m-%d")
-        self.competitor_db.store_competitor_data(competitor.name, current_content, today)
-
-        historical_query = """
-        What are the main changes in terms of:
-        1. Pricing
-        2. Products
-        3. Partnerships
-        4. Funding
-        5. Positioning
-        Compare with historical data and identify significant changes.
+    async def analyze_competitor_website(
+        self,
+        competitor: Competitor,
+        content_changed: bool = True,
+        today: Optional[str] = None
+    ) -> Dict[str, Any]:
+        today = today or datetime.now().strftime("%Y-%m-%d")
+        # Stored snapshots carry their date in the context, so naming the
+        # run date tells the model which one is "latest".
+        run_date = f"""
+        Today is {today}; the latest snapshot is the most recent one dated on or before it.
         """
-        historical_analysis = self.competitor_db.query_competitor_history(
-            competitor.name,
-            historical_query
-        )
-        current_analysis = self.competitor_db.query_competitor_history(
-            competitor.name,
+        if not content_changed:
+            # Nothing new was stored, so only the historical view can change;
+            # the current snapshot is the one analysed when the page last changed.
+            historical_query = """
+            What are the main changes in terms of:
+            1. Pricing
+            2. Products
+            3. Partnerships
+            4. Funding
+            5. Positioning
+            Compare with historical data and identify significant changes.
             """
-            Analyze the latest content and identify:
-            1. Current pricing information
-            2. Product offerings
-            3. Recent partnerships
-            4. Funding news
-            5. Market positioning
-            Provide the analysis in JSON format.
-            """
-        )
+            response = await self._query_history(competitor.name, run_date + historical_query)
+            analysis_result = self.parse_analysis(response)
+            analysis_result.update(self.competitor_db.get_latest_analysis(competitor.name))
+            return analysis_result
+        analysis_query = """
+        Compare the latest content with historical data and respond with a single
+        JSON object using exactly these keys:
+        {
+            "historical_changes": "significant changes over time in pricing, products, partnerships, funding and positioning",
+            "pricing_changes": ["current pricing information"],
+            "product_launches": ["current product offerings"],
+            "partnerships": ["recent partnerships"],
+            "funding": ["funding news"],
+            "positioning_changes": ["current market positioning"]
+        }
+        If you cannot produce JSON, answer in two sections titled
+        "## Historical Changes" and "## Current Snapshot", with the current
+        snapshot given as JSON.
+        """
+        response = await self._query_history(competitor.name, run_date + analysis_query)
+        analysis_result, parsed = self._parse_analysis(response)
+        if parsed:
+            self.competitor_db.record_analysis(competitor.name, {
+                key: value
+                for key, value in analysis_result.items()
+                if key != "historical_changes"
+            })
+        else:
+            # A failed or unparseable answer must not overwrite the last good
+            # snapshot, which unchanged runs keep reusing.
+            logger.warning(f"Could not parse current analysis for {competitor.name}, keeping the previous one")
+        return analysis_result
+
+    async def _query_history(self, competitor_name: str, query: str) -> str:
+        async with self._llm_sem:
+            return await asyncio.to_thread(
+                self.competitor_db.query_competitor_history,
+                competitor_name,
+                query
+            )
+
+    @staticmethod
+    def parse_analysis(response: str) -> Dict[str, Any]:
+        return CompetitiveAnalysisAgent._parse_analysis(response)[0]
+
+    @staticmethod
+    def _parse_analysis(response: str) -> Tuple[Dict[str, Any], bool]:
+        # The flag says whether the response held a JSON object, i.e. whether
+        # the current-snapshot fields came from the model or are defaults.
+        analysis_result = {
+            "pricing_changes": [],
+            "product_launches": [],
+            "partnerships": [],
+            "funding": [],
+            "positioning_changes": []
+        }
+        historical_analysis = ""
         try:
-            analysis_result = json.loads(current_analysis)
-        except json.JSONDecodeError:
-            analysis_result = {
-                "pricing_changes": [],
-                "product_launches": [],
-                "partnerships": [],
-                "funding": [],
-                "positioning_changes": []
-            }
+            parsed = orjson.loads(response)
+        except orjson.JSONDecodeError:
+            parsed = None
+            historical_match = _HISTORICAL_SECTION_RE.search(response)
+            if historical_match:
+                historical_analysis = historical_match.group(1).strip()
+            current_match = _CURRENT_SECTION_RE.search(response)
+            json_match = _JSON_OBJECT_RE.search(current_match.group(1) if current_match else response)
+            if json_match:
+                try:
+                    parsed = orjson.loads(json_match.group(0))
+                except orjson.JSONDecodeError:
+                    pass
+        if isinstance(parsed, dict):
+            historical_analysis = parsed.pop("historical_changes", historical_analysis)
+            analysis_result.update(parsed)
+        elif not historical_analysis:
+            historical_analysis = response
         analysis_result["historical_changes"] = historical_analysis
-        return analysis_result
+        return analysis_result, isinstance(parsed, dict)
 
-    async def generate_weekly_report(self, competitors: List[Competitor]) -> str:
-        all_analyses = []
-        for competitor in competitors:
-            analysis = await self.analyze_competitor_website(competitor)
-            all_analyses.append({
+    async def generate_weekly_report(
+        self,
+        competitors: List[Competitor],
+        today: Optional[str] = None
+    ) -> str:
+        today = today or datetime.now().strftime("%Y-%m-%d")
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def scrape(competitor: Competitor) -> ScrapeResult:
+            validators = self.competitor_db.get_page_validators(competitor.name)
+            async with semaphore:
+                return await self.web_scraper.scrape_website(
+                    competitor.website,
+                    etag=validators.get("etag"),
+                    last_modified=validators.get("last_modified")
+                )
+
+        async def run(competitor: Competitor) -> Dict[str, Any]:
+            analysis = await self.analyze_competitor_website(
+                competitor,
+                content_changed=competitor.name in changed,
+                today=today
+            )
+            return {
                 "competitor": competitor.name,
                 "analysis": analysis
-            })
-        report_prompt = f"""
-        Generate a weekly competitive analysis report based on the following data:
-        {json.dumps(all_analyses, indent=2)}
-        
-        Format the report with:
-        1. Executive Summary
-        2. Key Findings by Competitor
-        3. Market Trends
-        4. Historical Changes
-        5. Recommendations
-        
-        Focus on significant changes and their market impact.
-        """
-        query_engine = self.competitor_db.llm
-        report = query_engine.complete(report_prompt)
+            }
+
+        async with self.web_scraper:
+            pages = await asyncio.gather(
+                *(scrape(competitor) for competitor in competitors)
+            )
+        entries = []
+        changed: Dict[str, ScrapeResult] = {}
+        for competitor, page in zip(competitors, pages):
+            if page.not_modified:
+                logger.info(f"{competitor.name} not modified since last run, skipping storage")
+                continue
+            if not page.text:
+                logger.warning(f"No content scraped for {competitor.name}, skipping storage")
+                continue
+            if not self.competitor_db.has_page_changed(competitor.name, page.text):
+                logger.info(f"{competitor.name} content unchanged since last run, skipping storage")
+                # Refresh the validators so the next run can get a 304.
+                self.competitor_db.record_page(competitor.name, page)
+                continue
+            entries.append((competitor.name, page.text, today))
+            changed[competitor.name] = page
+        # One embedding request for every changed page's chunks (up to embed_batch_size)
+        # instead of one per competitor.
+        async with self._llm_sem:
+            stored = await asyncio.to_thread(self.competitor_db.store_competitor_batch, entries)
+        if stored:
+            for competitor_name, page in changed.items():
+                self.competitor_db.record_page(competitor_name, page)
+        else:
+            changed.clear()
+        results = await asyncio.gather(
+            *(run(competitor) for competitor in competitors),
+            return_exceptions=True
+        )
+        all_analyses = []
+        for competitor, result in zip(competitors, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error analyzing {competitor.name}: {str(result)}")
+                continue
+            all_analyses.append(result)
+        await asyncio.to_thread(self.competitor_db.flush)
+        async with self._llm_sem:
+            report = await asyncio.to_thread(self._summarize_analyses, all_analyses)
         return str(report)
 
-    def save_report(self, report: str, output_dir: str):
+    def _summarize_analyses(self, all_analyses: List[Dict[str, Any]]):
+        # Every analysis is summarised, but tree_summarize packs them into
+        # prompts that fit the context window and merges the partial
+        # summaries, so no single prompt grows with the number of competitors.
+        index = SummaryIndex.from_documents([
+            Document(
+                text=orjson.dumps(analysis).decode(),
+                metadata={"competitor": analysis["competitor"]}
+            )
+            for analysis in all_analyses
+        ])
+        query_engine = index.as_query_engine(
+            response_mode="tree_summarize",
+            summary_template=REPORT_PROMPT
+        )
+        return query_engine.query(REPORT_QUERY)
+
+    async def save_report(self, report: str, output_dir: str, today: Optional[str] = None):
         os.makedirs(output_dir, exist_ok=True)
-        timestamp = datetime.now().strftime("%Y%m%d")
+        today = today or datetime.now().strftime("%Y-%m-%d")
+        timestamp = today.replace("-", "")
         filename = f"competitive_analysis_report_{timestamp}.txt"
         filepath = os.path.join(output_dir, filename)
-        with open(filepath, 'w') as f:
-            f.write(report)
+        async with aiofiles.open(filepath, 'wb') as f:
+            await f.write(report.encode())
         logger.info(f"Report saved to {filepath}")
         return filepath
 
 async def main():
+    # asyncio.to_thread and aiofiles both run on the loop's default executor;
+    # one bounded pool keeps gathered llama-index calls from spawning threads
+    # ad hoc. The work is I/O-bound, so the pool always has room for every
+    # permitted Ollama request plus file writes and DNS lookups, even on
+    # small hosts. asyncio.run shuts it down on exit.
+    llm_parallel = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=max(min(32, (os.cpu_count() or 4) * 2), llm_parallel + 4),
+        thread_name_prefix="llama"
+    ))
     agent = CompetitiveAnalysisAgent()
     competitors = agent.load_competitors("competitors.json")
     if not competitors:
         logger.error("No competitors loaded. Please check your competitors.json file.")
         return
-    report = await agent.generate_weekly_report(competitors)
+    # One date for the whole run, even if it straddles midnight.
+    today = datetime.now().strftime("%Y-%m-%d")
+    report = await agent.generate_weekly_report(competitors, today=today)
     output_dir = "reports"
-    saved_path = agent.save_report(report, output_dir)
+    saved_path = await agent.save_report(report, output_dir, today=today)
     logger.info(f"Weekly competitive analysis completed. Report saved to: {saved_path}")
 
 if __name__ == "__main__":